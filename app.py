@@ -2,18 +2,22 @@
 # Main Flask application entry point
 
 import os
+import logging
 import sqlite3
 import threading
 import schedule
 import time
 from flask import Flask
-from config import config, DB_PATH
+from config import config, DB_PATH, LOG_LEVEL
+from utils.cache_utils import backfill_max_date_keys, SQLITE_PAGE_SIZE
 
 def create_app(config_name=None):
     """Application factory function"""
     if config_name is None:
         config_name = os.environ.get('FLASK_ENV', 'development')
     
+    logging.basicConfig(level=LOG_LEVEL)
+    
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
@@ -36,6 +40,14 @@ def init_db():
     with sqlite3.connect(DB_PATH) as conn:
         c = conn.cursor()
         
+        # Larger pages for the JSON cache blobs. page_size only applies to a database
+        # with no tables yet (and before WAL is enabled); existing files keep theirs.
+        if c.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+            c.execute(f'PRAGMA page_size={SQLITE_PAGE_SIZE}')
+        
+        # WAL lets readers proceed during cache writes; the mode persists in the file
+        c.execute('PRAGMA journal_mode=WAL')
+        
         # Create query_cache table
         c.execute('''
             CREATE TABLE IF NOT EXISTS query_cache (
@@ -46,11 +58,38 @@ def init_db():
             )
         ''')
         
+        # Migrate older databases: track reads for TTL eviction, the latest
+        # cached date_key (lets "is yesterday cached?" skip decoding the JSON)
+        # and seat_id derived from cache_key so seat listings use an index.
+        # table_xinfo (unlike table_info) also lists generated columns.
+        existing_columns = {row[1] for row in c.execute('PRAGMA table_xinfo(query_cache)')}
+        if 'last_accessed_at' not in existing_columns:
+            c.execute('ALTER TABLE query_cache ADD COLUMN last_accessed_at TIMESTAMP')
+        if 'max_date_key' not in existing_columns:
+            c.execute('ALTER TABLE query_cache ADD COLUMN max_date_key TEXT')
+        if 'seat_id' not in existing_columns:
+            c.execute('''
+                ALTER TABLE query_cache ADD COLUMN seat_id TEXT
+                GENERATED ALWAYS AS (
+                    CASE WHEN substr(cache_key, 1, 8) = 'seat_id_' THEN substr(cache_key, 9) END
+                ) VIRTUAL
+            ''')
+        
         # Create index for better performance
         c.execute('''
             CREATE INDEX IF NOT EXISTS idx_cache_created_at 
             ON query_cache(created_at)
         ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cache_max_date_key 
+            ON query_cache(max_date_key)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cache_seat_id 
+            ON query_cache(seat_id, max_date_key) WHERE seat_id IS NOT NULL
+        ''')
+        
+        backfill_max_date_keys(conn)
         
         conn.commit()
         print("✅ Database initialized successfully")
@@ -74,7 +113,7 @@ def register_blueprints(app):
 
 def init_auto_collection():
     """Initialize the auto-collection system"""
-    from config import AUTO_COLLECTION_ENABLED, AUTO_COLLECTION_TIME
+    from config import AUTO_COLLECTION_ENABLED, AUTO_COLLECTION_TIME, CACHE_EVICTION_INTERVAL_HOURS
     
     if not AUTO_COLLECTION_ENABLED:
         print("🚫 Auto-collection disabled")
@@ -83,9 +122,14 @@ def init_auto_collection():
     try:
         from utils.admin_utils import auto_collect_daily_data, run_scheduler
         
+        from utils.cache_utils import evict_stale_cache
+        
         # Schedule daily collection
         schedule.every().day.at(AUTO_COLLECTION_TIME).do(auto_collect_daily_data)
         
+        # Schedule periodic eviction of cache entries nobody reads anymore
+        schedule.every(CACHE_EVICTION_INTERVAL_HOURS).hours.do(evict_stale_cache)
+        
         # Start scheduler in background thread
         scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
         scheduler_thread.start()
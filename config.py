@@ -4,9 +4,16 @@
 import os
 from datetime import datetime
 
+# Logging Configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # Set to DEBUG for verbose query/cache diagnostics
+
 # Database Configuration
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'query_cache.db')
 
+# Cache Eviction Configuration
+CACHE_TTL_DAYS = int(os.getenv('CACHE_TTL_DAYS', '0'))  # Evict entries unused this long (0 disables; opt-in)
+CACHE_EVICTION_INTERVAL_HOURS = 6
+
 # Auto-collection Configuration
 AUTO_COLLECTION_ENABLED = True
 AUTO_COLLECTION_TIME = "06:00"  # 6 AM daily
@@ -4,8 +4,39 @@
 import sqlite3
 import json
 import hashlib
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from config import DB_PATH
+from config import DB_PATH, CACHE_TTL_DAYS
+
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Read pages through a memory map instead of pread()
+SQLITE_PAGE_SIZE = 8192  # Applied when init_db creates a new database file
+
+# Idle connections kept open between calls so the WAL/SHM files and page cache
+# stay warm; connections beyond this are closed when returned
+SQLITE_POOL_SIZE = 8
+_connection_pool = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
+
+# In-process memo of the cached seat_id list. _cache_keys_version is bumped whenever
+# this process adds or deletes cache entries; the TTL bounds staleness from writers
+# outside this module (admin tools, other processes).
+SEAT_ID_LIST_TTL_SECONDS = 30
+_cache_keys_version = 0
+_seat_id_list_cache = {'version': -1, 'ts': 0.0, 'val': None}
+_seat_id_list_lock = threading.Lock()
+
+# Rows appended per json_insert call (2 SQL function args per row, 127-arg limit on older SQLite)
+JSON_APPEND_BATCH_SIZE = 60
+SQLITE_IN_CHUNK_SIZE = 500  # Bound parameters per IN (...) list (999-variable limit on older SQLite)
+
+# Cache keys read since the last flush; last_accessed_at is written in batches
+# so reads don't each pay for a write transaction
+ACCESS_FLUSH_THRESHOLD = 50
+_accessed_keys = set()
+_accessed_keys_lock = threading.Lock()
 
 def get_yesterday_date():
     """Get yesterday's date string (exclude today's data everywhere)"""
@@ -19,6 +50,30 @@ def ensure_date_not_today(date_str):
         return get_yesterday_date()
     return date_str
 
+def serialize_cache_object(cache_object):
+    """Serialize a cache object to compact JSON (no whitespace after separators)
+    
+    Non-ASCII text (e.g. tag names) is kept as UTF-8 instead of 6-byte \\uXXXX escapes.
+    """
+    return json.dumps(cache_object, separators=(',', ':'), ensure_ascii=False)
+
+def build_column_index(columns):
+    """Build a column name -> position map stored alongside cached data"""
+    return {column: index for index, column in enumerate(columns)}
+
+def get_column_index(columns, column, col_index=None):
+    """Position of a column, using a precomputed col_index map when it is still valid"""
+    if col_index:
+        index = col_index.get(column)
+        # Guard against stale maps (e.g. columns edited by maintenance scripts)
+        if index is not None and index < len(columns) and columns[index] == column:
+            return index
+    return columns.index(column)
+
+def row_date_key(row, date_key_index):
+    """Date of a cached row as a string ('' for malformed rows so they sort first)"""
+    return str(row[date_key_index]) if len(row) > date_key_index else ''
+
 def generate_cache_key(query_type, entity_id):
     """Generate cache key for unified storage: query_type + entity_id"""
     if query_type == 'query1':
@@ -28,24 +83,123 @@ def generate_cache_key(query_type, entity_id):
     else:
         raise ValueError(f"Invalid query_type: {query_type}")
 
-def cache_get_unified(query_type, entity_id):
+def open_db(check_same_thread=True):
+    """Open a cache DB connection with the per-connection performance PRAGMAs applied
+    
+    journal_mode=WAL is persistent in the database file and is set once in init_db.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=check_same_thread)
+    conn.execute('PRAGMA synchronous=NORMAL')  # Safe with WAL; fsync only at checkpoints
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-20000')  # ~20 MB page cache
+    conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    return conn
+
+@contextmanager
+def cache_connection(conn=None):
+    """Use the caller's connection (caller owns the transaction) or borrow one from the pool
+    
+    A borrowed connection commits on success and rolls back on error before it
+    goes back to the pool, so no transaction is left open between borrowers.
+    """
+    if conn is not None:
+        yield conn
+        return
+    try:
+        own_conn = _connection_pool.get_nowait()
+    except queue.Empty:
+        own_conn = open_db(check_same_thread=False)
+    try:
+        with own_conn:
+            yield own_conn
+    finally:
+        try:
+            _connection_pool.put_nowait(own_conn)
+        except queue.Full:
+            own_conn.close()
+
+def invalidate_seat_id_list():
+    """Mark the memoized seat_id list stale after cache entries are added or deleted"""
+    global _cache_keys_version
+    with _seat_id_list_lock:
+        _cache_keys_version += 1
+
+def get_cached_seat_ids(conn=None):
+    """Get all cached seat_ids, memoized for SEAT_ID_LIST_TTL_SECONDS"""
+    with _seat_id_list_lock:
+        version = _cache_keys_version
+        if (_seat_id_list_cache['val'] is not None
+                and _seat_id_list_cache['version'] == version
+                and time.monotonic() - _seat_id_list_cache['ts'] < SEAT_ID_LIST_TTL_SECONDS):
+            return list(_seat_id_list_cache['val'])
+    
+    with cache_connection(conn) as db:
+        seat_ids = [row[0] for row in db.execute('SELECT seat_id FROM query_cache WHERE seat_id IS NOT NULL')]
+    
+    with _seat_id_list_lock:
+        _seat_id_list_cache.update(version=version, ts=time.monotonic(), val=seat_ids)
+    return list(seat_ids)
+
+def cache_get_unified(query_type, entity_id, conn=None):
     """Retrieve unified cache object for seat_id or publisher_id"""
     cache_key = generate_cache_key(query_type, entity_id)
     
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
+    with cache_connection(conn) as db:
+        c = db.cursor()
         try:
             c.execute('SELECT result FROM query_cache WHERE cache_key = ?', (cache_key,))
             row = c.fetchone()
             if row:
+                # Inside a caller's transaction a flush would wait on the caller's own
+                # write lock from another connection, so only buffer the key then
+                record_cache_access(cache_key, flush=conn is None)
                 return json.loads(row[0])
             return None
         except Exception as e:
             print(f"❌ Cache get error for key {cache_key}: {e}")
             return None
 
-def cache_set_unified(query_type, entity_id, columns, new_data):
-    """Store unified cache object with deduplication"""
+def record_cache_access(cache_key, flush=True):
+    """Remember a cache read; flushes last_accessed_at once enough keys are buffered
+    
+    The threshold counts distinct keys, so with only a few seats last_accessed_at may
+    not be written until evict_stale_cache flushes it. Pass flush=False while a
+    transaction is open; the key is written by a later flush.
+    """
+    with _accessed_keys_lock:
+        _accessed_keys.add(cache_key)
+        should_flush = flush and len(_accessed_keys) >= ACCESS_FLUSH_THRESHOLD
+    if should_flush:
+        flush_cache_access_times()
+
+def flush_cache_access_times():
+    """Write buffered cache reads to last_accessed_at in one transaction"""
+    with _accessed_keys_lock:
+        keys = list(_accessed_keys)
+        _accessed_keys.clear()
+    if not keys:
+        return 0
+    
+    now = datetime.now().isoformat()
+    try:
+        with cache_connection() as conn:
+            conn.executemany(
+                'UPDATE query_cache SET last_accessed_at = ? WHERE cache_key = ?',
+                [(now, key) for key in keys]
+            )
+            conn.commit()
+        return len(keys)
+    except Exception as e:
+        print(f"❌ Error flushing cache access times: {e}")
+        return 0
+
+def cache_set_unified(query_type, entity_id, columns, new_data, conn=None):
+    """Store unified cache object with deduplication
+    
+    Pass conn to write inside the caller's transaction; the caller then commits.
+    """
     cache_key = generate_cache_key(query_type, entity_id)
     
     print(f"🔧 Cache set: {len(columns)} columns, {len(new_data)} rows")
@@ -57,7 +211,7 @@ def cache_set_unified(query_type, entity_id, columns, new_data):
         return False
     
     # Get existing cache object
-    existing_cache = cache_get_unified(query_type, entity_id)
+    existing_cache = cache_get_unified(query_type, entity_id, conn=conn)
     
     if existing_cache is None:
         # Create new cache object
@@ -124,21 +278,168 @@ def cache_set_unified(query_type, entity_id, columns, new_data):
             print(f"❌ Row content: {row}")
             continue
     
+    cache_object['col_index'] = build_column_index(cache_object['columns'])
+    
+    # Keep rows ordered by date_key so readers can binary-search date ranges.
+    # Existing data is already sorted, so timsort only merges in the new rows.
+    cache_object['data'].sort(key=lambda row: row_date_key(row, date_key_index))
+    cache_object['sorted_by'] = 'date_key'
+    max_date_key = (row_date_key(cache_object['data'][-1], date_key_index) or None) if cache_object['data'] else None
+    
     # Store updated cache object
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
+    with cache_connection(conn) as db:
+        c = db.cursor()
         try:
             c.execute(
-                'REPLACE INTO query_cache (cache_key, result, updated_at) VALUES (?, ?, ?)',
-                (cache_key, json.dumps(cache_object), datetime.now().isoformat())
+                'REPLACE INTO query_cache (cache_key, result, updated_at, max_date_key) VALUES (?, ?, ?, ?)',
+                (cache_key, serialize_cache_object(cache_object), datetime.now().isoformat(), max_date_key)
             )
-            conn.commit()
+            if conn is None:
+                db.commit()
+            if existing_cache is None:
+                invalidate_seat_id_list()
             print(f"✅ Cached {new_records_added} new records for {cache_key} (total: {len(cache_object['data'])})")
             return True
         except Exception as e:
             print(f"❌ Cache set error for {cache_key}: {e}")
             return False
 
+def _rows_to_append(columns, new_data):
+    """Deduplicated, date-sorted rows from new_data that may be appended (excludes today)"""
+    try:
+        tag_id_index = columns.index('tag_id')
+        date_key_index = columns.index('date_key')
+    except ValueError:
+        return []
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    rows = []
+    seen = set()
+    for row in new_data:
+        if len(row) <= max(date_key_index, tag_id_index):
+            continue
+        row_date = str(row[date_key_index])
+        combo_key = (row_date, row[tag_id_index])
+        if row_date >= today or combo_key in seen:
+            continue
+        seen.add(combo_key)
+        rows.append(row)
+
+    rows.sort(key=lambda row: row_date_key(row, date_key_index))
+    return rows
+
+def _json_append_sql(row_count):
+    """UPDATE statement appending row_count JSON rows to an entry's data array"""
+    paths = ', '.join(["'$.data[#]', json(?)"] * row_count)
+    return f'UPDATE query_cache SET result = json_insert(result, {paths}) WHERE cache_key = ?'
+
+def cache_append_rows_bulk(query_type, rows_by_entity, columns, conn=None):
+    """Append rows newer than everything cached for many entities, without decoding them
+
+    Uses SQLite's JSON1 json_insert so only the new rows are serialized in Python.
+    An entity is only appended when its entry exists, is date_key-sorted, has the
+    same columns and every new row is strictly newer than max_date_key. Returns the
+    set of entity_ids appended; the rest are untouched and callers should fall back
+    to cache_set_unified for them.
+    """
+    date_key_index = columns.index('date_key') if 'date_key' in columns else None
+    pending = {}
+    for entity_id, new_data in rows_by_entity.items():
+        rows = _rows_to_append(columns, new_data)
+        if rows:
+            pending[generate_cache_key(query_type, entity_id)] = (entity_id, rows)
+    if not pending:
+        return set()
+
+    columns_json = serialize_cache_object(columns)
+    now = datetime.now().isoformat()
+    appended = set()
+    with cache_connection(conn) as db:
+        if conn is None:
+            # Keep the eligibility check and the appends atomic against other writers
+            db.execute('BEGIN IMMEDIATE')
+
+        # One eligibility query per chunk of keys instead of a guarded UPDATE per entity
+        eligible = []
+        cache_keys = list(pending)
+        for start in range(0, len(cache_keys), SQLITE_IN_CHUNK_SIZE):
+            chunk = cache_keys[start:start + SQLITE_IN_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            for cache_key, max_date_key in db.execute(f'''
+                SELECT cache_key, max_date_key FROM query_cache
+                WHERE cache_key IN ({placeholders})
+                  AND json_valid(result)
+                  AND json_extract(result, '$.sorted_by') = 'date_key'
+                  AND json_extract(result, '$.columns') = json(?)
+            ''', chunk + [columns_json]):
+                rows = pending[cache_key][1]
+                if max_date_key is not None and max_date_key < row_date_key(rows[0], date_key_index):
+                    eligible.append(cache_key)
+
+        # Group batches by row count so each statement shape is prepared once and run
+        # with executemany. Only an entity's last batch can be short, so per-entity
+        # row order is preserved when the full-size batches run first.
+        params_by_size = {}
+        date_updates = []
+        for cache_key in eligible:
+            entity_id, rows = pending[cache_key]
+            for start in range(0, len(rows), JSON_APPEND_BATCH_SIZE):
+                batch = rows[start:start + JSON_APPEND_BATCH_SIZE]
+                params_by_size.setdefault(len(batch), []).append(
+                    [serialize_cache_object(row) for row in batch] + [cache_key]
+                )
+            date_updates.append((row_date_key(rows[-1], date_key_index), now, cache_key))
+            appended.add(entity_id)
+
+        for row_count in sorted(params_by_size, reverse=True):
+            db.executemany(_json_append_sql(row_count), params_by_size[row_count])
+        db.executemany('UPDATE query_cache SET max_date_key = ?, updated_at = ? WHERE cache_key = ?', date_updates)
+        if conn is None:
+            db.commit()
+
+    if appended:
+        print(f"✅ Appended new records to {len(appended)} cache entries")
+    return appended
+
+def get_max_date_keys(query_type, entity_ids, conn=None):
+    """Map entity_id -> stored max_date_key for existing entries, without decoding them"""
+    keys = {generate_cache_key(query_type, entity_id): entity_id for entity_id in entity_ids}
+    cache_keys = list(keys)
+    max_date_keys = {}
+    with cache_connection(conn) as db:
+        for start in range(0, len(cache_keys), SQLITE_IN_CHUNK_SIZE):
+            chunk = cache_keys[start:start + SQLITE_IN_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            for cache_key, max_date_key in db.execute(
+                f'SELECT cache_key, max_date_key FROM query_cache WHERE cache_key IN ({placeholders})', chunk
+            ):
+                max_date_keys[keys[cache_key]] = max_date_key
+    return max_date_keys
+
+def backfill_max_date_keys(conn=None):
+    """Populate max_date_key for seat/publisher entries written without it"""
+    with cache_connection(conn) as db:
+        c = db.cursor()
+        # Latest date_key per entry, computed in SQLite with JSON1 so no blob is
+        # decoded into Python objects just to find it
+        c.execute("""
+            SELECT cache_key, (
+                SELECT max(NULLIF(CAST(json_extract(d.value, '$[' || k.key || ']') AS TEXT), ''))
+                FROM json_each(result, '$.columns') AS k, json_each(result, '$.data') AS d
+                WHERE k.value = 'date_key' AND d.type = 'array'
+            ) FROM query_cache
+            WHERE max_date_key IS NULL
+              AND (cache_key LIKE 'seat_id_%' OR cache_key LIKE 'publisher_id_%')
+              AND json_valid(result)
+        """)
+        updates = [(max_date_key, cache_key) for cache_key, max_date_key in c.fetchall() if max_date_key]
+        
+        c.executemany('UPDATE query_cache SET max_date_key = ? WHERE cache_key = ?', updates)
+    
+    if updates:
+        print(f"🔧 Backfilled max_date_key for {len(updates)} cache entries")
+    return len(updates)
+
 def validate_data_structure(columns, data):
     """Validate that data structure is consistent"""
     if not columns:
@@ -168,6 +469,13 @@ def validate_data_structure(columns, data):
 
 def find_missing_dates(query_type, entity_id, date_from, date_to):
     """Find missing dates in cache for the specified entity and date range"""
+    # Convert missing dates to date ranges
+    return get_date_ranges_to_query_from_dates(
+        find_missing_date_list(query_type, entity_id, date_from, date_to)
+    )
+
+def find_missing_date_list(query_type, entity_id, date_from, date_to):
+    """Find the individual dates (sorted) missing from cache for the entity and date range"""
     # Ensure dates don't include today
     date_to = ensure_date_not_today(date_to)
     
@@ -175,17 +483,26 @@ def find_missing_dates(query_type, entity_id, date_from, date_to):
         print(f"⚠️ Invalid date range after today exclusion: {date_from} to {date_to}")
         return []
     
+    # Generate requested date range
+    requested_dates = []
+    current = datetime.strptime(date_from, '%Y-%m-%d')
+    end = datetime.strptime(date_to, '%Y-%m-%d')
+    
+    while current <= end:
+        requested_dates.append(current.strftime('%Y-%m-%d'))
+        current += timedelta(days=1)
+    
     # Get existing cache
     cache_object = cache_get_unified(query_type, entity_id)
     
     if cache_object is None:
         # No cache exists, need all dates
-        return get_date_ranges_to_query(date_from, date_to)
+        return requested_dates
     
     # Find which dates we already have
     try:
         columns = cache_object['columns']
-        date_key_index = columns.index('date_key')
+        date_key_index = get_column_index(columns, 'date_key', cache_object.get('col_index'))
         cached_dates = set()
         for row in cache_object['data']:
             try:
@@ -195,28 +512,17 @@ def find_missing_dates(query_type, entity_id, date_from, date_to):
                 continue
     except (ValueError, KeyError):
         print(f"❌ Invalid cache structure for {entity_id}")
-        return get_date_ranges_to_query(date_from, date_to)
-    
-    # Generate requested date range
-    requested_dates = set()
-    current = datetime.strptime(date_from, '%Y-%m-%d')
-    end = datetime.strptime(date_to, '%Y-%m-%d')
-    
-    while current <= end:
-        requested_dates.add(current.strftime('%Y-%m-%d'))
-        current += timedelta(days=1)
+        return requested_dates
     
     # Find missing dates
-    missing_dates = requested_dates - cached_dates
+    missing_dates = [date for date in requested_dates if date not in cached_dates]
     
     if not missing_dates:
         print(f"✅ All dates cached for {entity_id}")
         return []
     
-    print(f"🔍 Found {len(missing_dates)} missing dates for {entity_id}: {sorted(missing_dates)}")
-    
-    # Convert missing dates to date ranges
-    return get_date_ranges_to_query_from_dates(sorted(missing_dates))
+    print(f"🔍 Found {len(missing_dates)} missing dates for {entity_id}: {missing_dates}")
+    return missing_dates
 
 def get_date_ranges_to_query(date_from, date_to):
     """Convert date range to list of ranges (for chunking)"""
@@ -325,15 +631,44 @@ def search_tags_in_cache(query_type, entity_id, search_term, date_from, date_to)
 
 def clear_cache():
     """Clear all cache entries"""
-    with sqlite3.connect(DB_PATH) as conn:
+    with cache_connection() as conn:
         c = conn.cursor()
         c.execute('DELETE FROM query_cache')
         conn.commit()
         print("🗑️ All cache cleared successfully!")
+    invalidate_seat_id_list()
+
+def evict_stale_cache(ttl_days=None):
+    """Delete seat/publisher cache entries not read or updated within ttl_days"""
+    ttl_days = CACHE_TTL_DAYS if ttl_days is None else ttl_days
+    if ttl_days <= 0:
+        return 0
+    
+    flush_cache_access_times()
+    
+    # Compare on the date prefix so both ISO ('T') and CURRENT_TIMESTAMP (' ') formats work
+    cutoff = (datetime.now() - timedelta(days=ttl_days)).strftime('%Y-%m-%d')
+    try:
+        with cache_connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+                DELETE FROM query_cache
+                WHERE (cache_key LIKE 'seat_id_%' OR cache_key LIKE 'publisher_id_%')
+                  AND MAX(COALESCE(last_accessed_at, ''), COALESCE(updated_at, '')) < ?
+            ''', (cutoff,))
+            deleted_count = c.rowcount
+            conn.commit()
+        if deleted_count:
+            invalidate_seat_id_list()
+        print(f"🗑️ Evicted {deleted_count} cache entries unused since {cutoff}")
+        return deleted_count
+    except Exception as e:
+        print(f"❌ Cache eviction error: {e}")
+        return 0
 
 def get_cache_stats():
     """Get cache statistics"""
-    with sqlite3.connect(DB_PATH) as conn:
+    with cache_connection() as conn:
         c = conn.cursor()
         c.execute('SELECT COUNT(*) FROM query_cache')
         total_entries = c.fetchone()[0]
@@ -367,14 +702,11 @@ def get_cache_stats():
 def get_all_cache_keys():
     """Get all cache keys from the database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT cache_key FROM query_cache")
-        keys = [row[0] for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
+        with cache_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT cache_key FROM query_cache")
+            keys = [row[0] for row in cursor.fetchall()]
+            cursor.close()
         
         return keys
     except Exception as e:
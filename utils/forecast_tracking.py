@@ -6,6 +6,7 @@ import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from config import DB_PATH
+from utils.cache_utils import record_cache_access
 
 # Tag to Country mapping based on the provided table
 TAG_TO_COUNTRY_MAPPING = {
@@ -202,6 +203,8 @@ def get_actual_delivery(publisher_id: str, geo: str = None, start_date: str = Q3
             
             if not result:
                 return {"error": f"No cached data found for publisher_id_{publisher_id}"}
+            # Count as a use so cache eviction keeps publishers only read here
+            record_cache_access(f"publisher_id_{publisher_id}")
             
             cache_data = json.loads(result[0])
             if 'data' not in cache_data or 'columns' not in cache_data:
@@ -437,6 +440,8 @@ def analyze_tag_mapping_for_publisher(publisher_id: str) -> Dict:
             
             if not result:
                 return {"error": f"No cached data found for publisher_id_{publisher_id}"}
+            # Count as a use so cache eviction keeps publishers only read here
+            record_cache_access(f"publisher_id_{publisher_id}")
             
             cache_data = json.loads(result[0])
             if 'data' not in cache_data or 'columns' not in cache_data:
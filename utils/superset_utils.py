@@ -2,30 +2,69 @@
 # Optimized Superset API queries with chunking and caching integration
 
 from re import escape
-import sqlite3
+import logging
+import string
+import threading
+import time
 import requests
-from config import DB_PATH
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from operator import itemgetter
 import json
 from datetime import datetime, timedelta
 from utils.cache_utils import (
     find_missing_dates, 
+    find_missing_date_list,
     cache_set_unified, 
+    cache_append_rows_bulk,
     cache_get_unified,
+    cache_connection,
+    backfill_max_date_keys,
     ensure_date_not_today,
-    get_all_cache_keys
+    get_all_cache_keys,
+    get_cached_seat_ids,
+    get_column_index,
+    get_max_date_keys,
+    row_date_key
 )
 
+logger = logging.getLogger(__name__)
+
 # --- Superset API Config ---
 SUPERSET_EXECUTE_URL = "https://superset.de.gcp.rokulabs.net/api/v1/sqllab/execute/"
 SUPERSET_HEADERS = {
     "Accept": "application/json",
     "Content-Type": "application/json",
+    "Connection": "keep-alive",
     "Referer": "Placeholder"
     "Origin": Placeholder"
     "X-CSRFToken": Placeholder"
     "Cookie": "Placeholder"
 }
 SUPERSET_DB_ID = 2
+SUPERSET_MAX_CONCURRENCY = 4  # Max parallel Superset queries per fetch
+
+# Shared HTTP session: keeps TCP/TLS connections to Superset alive across calls (and
+# across the concurrent chunk fetches) and retries transient connection failures
+SUPERSET_HTTP_POOL_SIZE = 8
+SUPERSET_SESSION = requests.Session()
+SUPERSET_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=SUPERSET_HTTP_POOL_SIZE,
+    pool_maxsize=SUPERSET_HTTP_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.2)
+))
+
+# Short-lived in-process memo of Superset results, so retries/fallbacks that resubmit
+# the same SQL within seconds don't pay another round trip (data excludes today,
+# so a result can't go stale within the TTL)
+SUPERSET_RESULT_TTL_SECONDS = 30
+SUPERSET_RESULT_CACHE_SIZE = 128
+_recent_results = OrderedDict()  # sql -> (expires_at, columns, rows)
+_recent_results_lock = threading.Lock()
 
 # --- Working Query Template ---
 QUERY_TEMPLATE = """
@@ -61,6 +100,144 @@ ORDER BY
 LIMIT 10000
 """
 
+# --- Query 1 (seat_id) Templates ---
+# Built once at import time; call sites only substitute the quoted literals.
+_Q1_SELECT = """
+SELECT 
+    t.name AS tag_name,
+    m.seat_id,
+    m.tag_id,
+    SUM(m.ad_query_requests) AS total_ad_query_requests,
+    SUM(m.ad_query_responses) AS total_ad_query_responses,
+    SUM(m.ad_slot_requests) AS total_ad_slot_requests,
+    SUM(m.ad_slot_responses) AS total_ad_slot_responses,
+    SUM(m.ad_creative_fetches) AS total_ad_creative_fetches,
+    SUM(m.ad_creative_responses) AS total_ad_creative_responses,
+    CASE 
+        WHEN SUM(m.ad_slot_requests) > 0 
+        THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_slot_requests))
+        ELSE 0 
+    END AS fill_rate,
+    CASE 
+        WHEN SUM(m.ad_creative_responses) > 0 
+        THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_creative_responses))
+        ELSE 0 
+    END AS avg_render_rate,
+    SUM(m.num_impressions) AS total_impressions,
+    m.date_key
+FROM advertising.agg_raps_rams_metrics_daily_v2 m
+LEFT JOIN ads.dim_rams_tags_history t ON m.tag_id = t.tag_id AND t.date_key = m.date_key
+"""
+
+_Q1_TEMPLATE = string.Template(_Q1_SELECT + """WHERE $date_predicate 
+  AND m.seat_id = $seat_id
+  AND m.date_id_est IS NOT NULL
+GROUP BY 
+    t.name, m.seat_id, m.tag_id, m.date_key
+ORDER BY m.date_key DESC
+""")
+
+_Q1_BULK_TEMPLATE = string.Template(_Q1_SELECT + """WHERE m.date_key BETWEEN $date_from AND $date_to 
+  AND m.seat_id IN ($seat_id_list)
+  AND m.date_id_est IS NOT NULL
+GROUP BY 
+    t.name, m.seat_id, m.tag_id, m.date_key
+ORDER BY m.seat_id, m.date_key DESC
+""")
+
+# Column order of Query 1 rows (matches _Q1_SELECT) and a C-level getter that pulls
+# them from a dict row in one call; missing keys fall back to ''
+_QUERY1_COLUMNS = ['tag_name', 'seat_id', 'tag_id', 'total_ad_query_requests', 'total_ad_query_responses', 
+                   'total_ad_slot_requests', 'total_ad_slot_responses', 'total_ad_creative_fetches', 
+                   'total_ad_creative_responses', 'fill_rate', 'avg_render_rate', 'total_impressions', 'date_key']
+_SEAT_ID_INDEX = _QUERY1_COLUMNS.index('seat_id')
+_ROW_GETTER = itemgetter(*_QUERY1_COLUMNS)
+_QUERY1_ROW_DEFAULTS = dict.fromkeys(_QUERY1_COLUMNS, '')
+
+# Yesterday's refresh joins an inline VALUES relation instead of a long IN (...) list,
+# so Presto can hash-join the seat list
+_Q1_SEATS_DAY_TEMPLATE = string.Template(_Q1_SELECT + """JOIN (VALUES $seat_values) AS s(seat_id) ON m.seat_id = s.seat_id
+WHERE m.date_key = $date_key 
+  AND m.date_id_est IS NOT NULL
+GROUP BY 
+    t.name, m.seat_id, m.tag_id, m.date_key
+ORDER BY m.seat_id, m.date_key DESC
+""")
+
+# --- Query 2 (publisher_id) Template ---
+_Q2_TEMPLATE = string.Template("""
+WITH aggregated_requests AS (
+    SELECT 
+        tag_id,
+        date_key,
+        SUM(pod_based_ad_requests) AS total_pod_based_ad_requests,
+        SUM(pod_unfilled_ad_requests) AS total_pod_unfilled_ad_requests,
+        SUM(num_unfiltered_ad_requests) AS total_num_unfiltered_ad_requests
+    FROM advertising.granular_rams_video_ad_requests
+    WHERE date_key BETWEEN $date_from AND $date_to
+    GROUP BY tag_id, date_key
+),
+aggregated_impressions AS (
+    SELECT 
+        tag_id,
+        date_key,
+        SUM(num_unfiltered_impressions) AS total_num_unfiltered_impressions
+    FROM advertising.granular_rams_video_ad_impressions
+    WHERE date_key BETWEEN $date_from AND $date_to
+    GROUP BY tag_id, date_key
+)
+SELECT 
+    t.publisher_id,
+    t.tag_id,
+    t.name AS tag_name,
+    r.date_key,
+    r.total_pod_based_ad_requests,
+    r.total_pod_unfilled_ad_requests,
+    r.total_num_unfiltered_ad_requests,
+    i.total_num_unfiltered_impressions,
+    CASE 
+        WHEN r.total_pod_based_ad_requests > 0 
+        THEN ((r.total_pod_based_ad_requests - r.total_pod_unfilled_ad_requests) * 100.0 / r.total_pod_based_ad_requests)
+        ELSE 0 
+    END AS fill_rate,
+    CASE 
+        WHEN r.total_num_unfiltered_ad_requests > 0 
+        THEN (i.total_num_unfiltered_impressions * 100.0 / r.total_num_unfiltered_ad_requests)
+        ELSE 0 
+    END AS impression_rate
+FROM 
+    ads.dim_rams_tags_history t
+JOIN 
+    aggregated_requests r
+    ON t.tag_id = r.tag_id AND t.date_key = r.date_key
+JOIN 
+    aggregated_impressions i
+    ON t.tag_id = i.tag_id AND t.date_key = i.date_key
+WHERE 
+    t.publisher_id = $publisher_id
+ORDER BY 
+    t.publisher_id,
+    t.tag_id,
+    r.date_key DESC,
+    t.name
+""")
+
+MAX_DATES_PER_QUERY = 21  # Same ceiling get_date_ranges_to_query allows for a single range
+SEAT_IDS_PER_QUERY = 500  # Seats per yesterday-refresh query (chunks are fetched concurrently)
+
+def sql_literal(value):
+    """Render a value as a single-quoted SQL string literal (quotes escaped)"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _date_key_predicate(dates):
+    """Predicate matching exactly the given sorted dates: BETWEEN if contiguous, else IN (...)"""
+    first = datetime.strptime(dates[0], '%Y-%m-%d')
+    last = datetime.strptime(dates[-1], '%Y-%m-%d')
+    if (last - first).days == len(dates) - 1:
+        return f"m.date_key BETWEEN {sql_literal(dates[0])} AND {sql_literal(dates[-1])}"
+    return f"m.date_key IN ({', '.join(sql_literal(date) for date in dates)})"
+
+
 def test_superset_connection():
     """Test the Superset API connection with a simple query"""
     test_sql = "SELECT 1 as test_column"
@@ -76,7 +253,7 @@ def test_superset_connection():
         print(f"🔄 Headers: {SUPERSET_HEADERS}")
         print(f"🔄 Payload: {payload}")
         
-        response = requests.post(
+        response = SUPERSET_SESSION.post(
             SUPERSET_EXECUTE_URL, 
             headers=SUPERSET_HEADERS, 
             data=json.dumps(payload),
@@ -113,48 +290,62 @@ def generate_mock_data(date_from, date_to, entity_id, query_type):
     """Generate mock data for testing when API is unavailable"""
     print(f"🔄 Generating mock data for {query_type} - {entity_id} ({date_from} to {date_to})")
     
-    # Generate date range
-    start_date = datetime.strptime(date_from, '%Y-%m-%d')
-    end_date = datetime.strptime(date_to, '%Y-%m-%d')
-    dates = []
-    current = start_date
-    while current <= end_date:
-        dates.append(current.strftime('%Y-%m-%d'))
-        current += timedelta(days=1)
+    # Generate date range (date.isoformat() yields the same YYYY-MM-DD as strftime, faster)
+    start_date = datetime.strptime(date_from, '%Y-%m-%d').date()
+    end_date = datetime.strptime(date_to, '%Y-%m-%d').date()
+    num_days = max((end_date - start_date).days + 1, 0)
+    dates = [(start_date + timedelta(days=offset)).isoformat() for offset in range(num_days)]
     
     if query_type == 'query1':
         # Mock data for Query 1 (seat_id)
         columns = ['date_key', 'tag_id', 'tag_name', 'total_impressions', 'total_ad_query_requests', 'total_ad_query_responses']
-        data = []
-        for date in dates:
-            for i in range(3):  # 3 tags per day
-                data.append([
-                    date,
-                    f"tag_{entity_id}_{i}",
-                    f"Mock Tag {i}",
-                    (i + 1) * 1000,
-                    (i + 1) * 500,
-                    (i + 1) * 450
-                ])
+        tag_templates = [
+            (f"tag_{entity_id}_{i}", f"Mock Tag {i}", (i + 1) * 1000, (i + 1) * 500, (i + 1) * 450)
+            for i in range(3)  # 3 tags per day
+        ]
     else:
         # Mock data for Query 2 (publisher_id)
         columns = ['date_key', 'tag_id', 'tag_name', 'video_impressions', 'video_requests', 'video_responses']
-        data = []
-        for date in dates:
-            for i in range(2):  # 2 tags per day
-                data.append([
-                    date,
-                    f"pub_tag_{entity_id}_{i}",
-                    f"Publisher Tag {i}",
-                    (i + 1) * 800,
-                    (i + 1) * 400,
-                    (i + 1) * 380
-                ])
+        tag_templates = [
+            (f"pub_tag_{entity_id}_{i}", f"Publisher Tag {i}", (i + 1) * 800, (i + 1) * 400, (i + 1) * 380)
+            for i in range(2)  # 2 tags per day
+        ]
+    
+    # Per-tag values don't depend on the date, so build them once and stamp each day
+    data = [[date, *tag_values] for date in dates for tag_values in tag_templates]
     
     print(f"✅ Generated {len(data)} mock rows")
     return columns, data
 
 def fetch_from_superset_api(sql):
+    """Execute SQL query via Superset API, reusing a result for identical SQL run moments ago"""
+    now = time.monotonic()
+    with _recent_results_lock:
+        # Drop expired results on every call so large ones aren't held past their TTL
+        for expired_sql in [key for key, entry in _recent_results.items() if entry[0] <= now]:
+            del _recent_results[expired_sql]
+        cached = _recent_results.get(sql)
+        if cached is not None:
+            _recent_results.move_to_end(sql)
+            logger.debug("♻️ Reusing Superset result for identical query (%d rows)", len(cached[2]))
+            return list(cached[1]), list(cached[2])
+    
+    columns, rows = _execute_superset_sql(sql)
+    
+    # Only successful results are kept; errors also come back as ([], [])
+    if rows:
+        # The TTL runs from when the result arrived, so slow queries aren't stored expired
+        expires_at = time.monotonic() + SUPERSET_RESULT_TTL_SECONDS
+        with _recent_results_lock:
+            _recent_results[sql] = (expires_at, columns, rows)
+            _recent_results.move_to_end(sql)
+            while len(_recent_results) > SUPERSET_RESULT_CACHE_SIZE:
+                _recent_results.popitem(last=False)
+    
+    # Callers get copies, so mutating a result can't alter the memoized one
+    return list(columns), list(rows)
+
+def _execute_superset_sql(sql):
     """Execute SQL query via Superset API"""
     payload = {
         "database_id": SUPERSET_DB_ID,
@@ -163,15 +354,15 @@ def fetch_from_superset_api(sql):
     }
     
     try:
-        print(f"🔄 Executing Superset API call...")
-        response = requests.post(
+        logger.debug("🔄 Executing Superset API call...")
+        response = SUPERSET_SESSION.post(
             SUPERSET_EXECUTE_URL, 
             headers=SUPERSET_HEADERS, 
             data=json.dumps(payload),
             timeout=600  # Increased timeout to 10 minutes
         )
         
-        print(f"📊 Response status: {response.status_code}")
+        logger.debug("📊 Response status: %s", response.status_code)
         
         if response.status_code == 401:
             print(f"❌ Authentication failed - session may be expired")
@@ -181,8 +372,9 @@ def fetch_from_superset_api(sql):
             print(f"❌ Access forbidden - check permissions")
             return [], []
         elif response.status_code in [200, 202]:
-            data = response.json()
-            print(f"🔍 Response structure: {type(data)} - Keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
+            data = json.loads(response.content)
+            response.close()
+            logger.debug("🔍 Response structure: %s - Keys: %s", type(data), list(data) if isinstance(data, dict) else 'Not a dict')
             
             # Handle different response structures
             if isinstance(data, dict):
@@ -205,7 +397,7 @@ def fetch_from_superset_api(sql):
                     rows = data.get('data', [])
             elif isinstance(data, list):
                 # Response is directly a list of rows
-                print(f"📋 Direct list response with {len(data)} items")
+                logger.debug("📋 Direct list response with %d items", len(data))
                 if data and isinstance(data[0], dict):
                     # Extract columns from first row keys
                     columns = list(data[0].keys())
@@ -218,33 +410,17 @@ def fetch_from_superset_api(sql):
                 return [], []
             
             # Normalize columns to always be strings
-            normalized_columns = []
-            for col in columns:
-                if isinstance(col, dict):
-                    # If column is a dict, try to extract the name
-                    col_name = col.get('name', col.get('column_name', col.get('label', str(col))))
-                    normalized_columns.append(str(col_name))
-                else:
-                    normalized_columns.append(str(col))
-            
-            columns = normalized_columns
+            columns = [_column_name(col) for col in columns]
             
             # Convert dictionary rows to list rows if needed
             if rows and isinstance(rows[0], dict):
-                print(f"🔄 Converting {len(rows)} dictionary rows to list format")
-                converted_rows = []
-                for row_dict in rows:
-                    # Convert dict to list in column order
-                    row_list = []
-                    for col_name in columns:
-                        row_list.append(row_dict.get(col_name))
-                    converted_rows.append(row_list)
-                rows = converted_rows
-                print(f"✅ Converted to list format: {len(rows)} rows")
+                logger.debug("🔄 Converting %d dictionary rows to row format", len(rows))
+                rows = _dict_rows_to_tuples(rows, columns)
+                logger.debug("✅ Converted to row format: %d rows", len(rows))
             
-            print(f"✅ Final data structure: {len(columns)} columns, {len(rows)} rows")
+            logger.debug("✅ Final data structure: %d columns, %d rows", len(columns), len(rows))
             if rows:
-                print(f"📋 Sample row: {rows[0][:3]}... (showing first 3 values)")
+                logger.debug("📋 Sample row: %s... (showing first 3 values)", rows[0][:3])
             
             return columns, rows
             
@@ -267,6 +443,38 @@ def fetch_from_superset_api(sql):
         print(f"❌ Unexpected error in API call: {str(e)}")
         return [], []
 
+def _column_name(col):
+    """Extract a column name from a Superset column descriptor"""
+    if isinstance(col, dict):
+        return str(col.get('name', col.get('column_name', col.get('label', str(col)))))
+    return str(col)
+
+def _dict_rows_to_tuples(rows, columns):
+    """Convert dictionary rows to tuple rows in column order
+    
+    The tuples produced by itemgetter are kept as-is (no extra list copy per row);
+    they validate and serialize exactly like list rows in the cache.
+    """
+    if not columns:
+        return [() for _ in rows]
+    
+    # itemgetter pulls every column in one C call per row
+    getter = itemgetter(*columns)
+    try:
+        if len(columns) == 1:
+            return [(getter(row),) for row in rows]
+        return [getter(row) for row in rows]
+    except KeyError:
+        # Some rows are missing columns - fall back to .get() with None defaults
+        return [tuple(row.get(col_name) for col_name in columns) for row in rows]
+
+def _query1_row(row):
+    """Convert a Query 1 dict row to a tuple in _QUERY1_COLUMNS order"""
+    try:
+        return _ROW_GETTER(row)
+    except KeyError:
+        return _ROW_GETTER({**_QUERY1_ROW_DEFAULTS, **row})
+
 def fetch_from_superset(date_from, date_to, seat_id):
     """Query 1: Fetch data for seat_id with smart caching"""
     # Ensure no today's data
@@ -279,9 +487,9 @@ def fetch_from_superset(date_from, date_to, seat_id):
     print(f"🔍 Query 1: Fetching data for seat_id {seat_id} from {date_from} to {date_to}")
     
     # Check cache and find missing dates
-    missing_ranges = find_missing_dates('query1', seat_id, date_from, date_to)
+    missing_dates = find_missing_date_list('query1', seat_id, date_from, date_to)
     
-    if not missing_ranges:
+    if not missing_dates:
         # All data cached, return from cache
         cache_object = cache_get_unified('query1', seat_id)
         if cache_object:
@@ -290,7 +498,9 @@ def fetch_from_superset(date_from, date_to, seat_id):
                 cache_object['columns'], 
                 cache_object['data'], 
                 date_from, 
-                date_to
+                date_to,
+                col_index=cache_object.get('col_index'),
+                sorted_by_date=cache_object.get('sorted_by') == 'date_key'
             )
             print(f"✅ All data from cache: {len(filtered_data)} rows")
             return cache_object['columns'], filtered_data
@@ -299,44 +509,21 @@ def fetch_from_superset(date_from, date_to, seat_id):
     all_new_data = []
     columns = None
     
-    for range_start, range_end in missing_ranges:
-        print(f"🔄 Fetching missing range: {range_start} to {range_end}")
-        from datetime import datetime
-        today = datetime.now().strftime('%Y-%m-%d')
-        sql = f"""
-        SELECT 
-            t.name AS tag_name,
-            m.seat_id,
-            m.tag_id,
-            SUM(m.ad_query_requests) AS total_ad_query_requests,
-            SUM(m.ad_query_responses) AS total_ad_query_responses,
-            SUM(m.ad_slot_requests) AS total_ad_slot_requests,
-            SUM(m.ad_slot_responses) AS total_ad_slot_responses,
-            SUM(m.ad_creative_fetches) AS total_ad_creative_fetches,
-            SUM(m.ad_creative_responses) AS total_ad_creative_responses,
-            CASE 
-                WHEN SUM(m.ad_slot_requests) > 0 
-                THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_slot_requests))
-                ELSE 0 
-            END AS fill_rate,
-            CASE 
-                WHEN SUM(m.ad_creative_responses) > 0 
-                THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_creative_responses))
-                ELSE 0 
-            END AS avg_render_rate,
-            SUM(m.num_impressions) AS total_impressions,
-            m.date_key
-        FROM advertising.agg_raps_rams_metrics_daily_v2 m
-        LEFT JOIN ads.dim_rams_tags_history t ON m.tag_id = t.tag_id AND t.date_key = m.date_key
-        WHERE m.date_key BETWEEN '{range_start}' AND '{range_end}' 
-          AND m.seat_id = '{seat_id}'
-          AND m.date_id_est IS NOT NULL
-        GROUP BY 
-            t.name, m.seat_id, m.tag_id, m.date_key
-        ORDER BY m.date_key DESC
-        """
-        print(f"🔍 Generated SQL for Query 1:")
-        print(f"🔍 {sql[:500]}...")
+    # Request exactly the missing dates, folding separate gaps into one IN (...)
+    # query instead of paying a round trip per gap
+    date_batches = [
+        missing_dates[i:i + MAX_DATES_PER_QUERY]
+        for i in range(0, len(missing_dates), MAX_DATES_PER_QUERY)
+    ]
+    
+    for date_batch in date_batches:
+        range_start, range_end = date_batch[0], date_batch[-1]
+        print(f"🔄 Fetching {len(date_batch)} missing dates: {range_start} to {range_end}")
+        sql = _Q1_TEMPLATE.substitute(
+            date_predicate=_date_key_predicate(date_batch),
+            seat_id=sql_literal(seat_id)
+        )
+        logger.debug("🔍 Generated SQL for Query 1:\n%.500s...", sql)
         
         try:
             range_columns, range_data = fetch_from_superset_api(sql)
@@ -379,7 +566,9 @@ def fetch_from_superset(date_from, date_to, seat_id):
                 cache_object['columns'], 
                 cache_object['data'], 
                 date_from, 
-                date_to
+                date_to,
+                col_index=cache_object.get('col_index'),
+                sorted_by_date=cache_object.get('sorted_by') == 'date_key'
             )
             print(f"✅ Filtered to {len(filtered_data)} rows for date range {date_from} to {date_to}")
             return cache_object['columns'], filtered_data
@@ -412,7 +601,9 @@ def fetch_from_superset_query2_with_fallback(date_from, date_to, publisher_id):
                 cache_object['columns'], 
                 cache_object['data'], 
                 date_from, 
-                date_to
+                date_to,
+                col_index=cache_object.get('col_index'),
+                sorted_by_date=cache_object.get('sorted_by') == 'date_key'
             )
             print(f"✅ All data from cache: {len(filtered_data)} rows")
             return cache_object['columns'], filtered_data
@@ -458,7 +649,9 @@ def fetch_from_superset_query2_with_fallback(date_from, date_to, publisher_id):
             cache_object['columns'], 
             cache_object['data'], 
             date_from, 
-            date_to
+            date_to,
+            col_index=cache_object.get('col_index'),
+            sorted_by_date=cache_object.get('sorted_by') == 'date_key'
         )
         return cache_object['columns'], filtered_data
     
@@ -467,67 +660,13 @@ def fetch_from_superset_query2_with_fallback(date_from, date_to, publisher_id):
 
 def fetch_query2_with_timeout_fallback(date_from, date_to, publisher_id):
     """Query 2 with automatic chunking on timeout"""
-    from datetime import datetime
-    today = datetime.now().strftime('%Y-%m-%d')
-    sql_query = f"""
-        WITH aggregated_requests AS (
-            SELECT 
-                tag_id,
-                date_key,
-                SUM(pod_based_ad_requests) AS total_pod_based_ad_requests,
-                SUM(pod_unfilled_ad_requests) AS total_pod_unfilled_ad_requests,
-                SUM(num_unfiltered_ad_requests) AS total_num_unfiltered_ad_requests
-            FROM advertising.granular_rams_video_ad_requests
-            WHERE date_key BETWEEN '{date_from}' AND '{date_to}'
-            GROUP BY tag_id, date_key
-        ),
-        aggregated_impressions AS (
-            SELECT 
-                tag_id,
-                date_key,
-                SUM(num_unfiltered_impressions) AS total_num_unfiltered_impressions
-            FROM advertising.granular_rams_video_ad_impressions
-            WHERE date_key BETWEEN '{date_from}' AND '{date_to}'
-            GROUP BY tag_id, date_key
-        )
-        SELECT 
-            t.publisher_id,
-            t.tag_id,
-            t.name AS tag_name,
-            r.date_key,
-            r.total_pod_based_ad_requests,
-            r.total_pod_unfilled_ad_requests,
-            r.total_num_unfiltered_ad_requests,
-            i.total_num_unfiltered_impressions,
-            CASE 
-                WHEN r.total_pod_based_ad_requests > 0 
-                THEN ((r.total_pod_based_ad_requests - r.total_pod_unfilled_ad_requests) * 100.0 / r.total_pod_based_ad_requests)
-                ELSE 0 
-            END AS fill_rate,
-            CASE 
-                WHEN r.total_num_unfiltered_ad_requests > 0 
-                THEN (i.total_num_unfiltered_impressions * 100.0 / r.total_num_unfiltered_ad_requests)
-                ELSE 0 
-            END AS impression_rate
-        FROM 
-            ads.dim_rams_tags_history t
-        JOIN 
-            aggregated_requests r
-            ON t.tag_id = r.tag_id AND t.date_key = r.date_key
-        JOIN 
-            aggregated_impressions i
-            ON t.tag_id = i.tag_id AND t.date_key = i.date_key
-        WHERE 
-            t.publisher_id = '{publisher_id}'
-        ORDER BY 
-            t.publisher_id,
-            t.tag_id,
-            r.date_key DESC,
-            t.name
-    """
+    sql_query = _Q2_TEMPLATE.substitute(
+        date_from=sql_literal(date_from),
+        date_to=sql_literal(date_to),
+        publisher_id=sql_literal(publisher_id)
+    )
     
-    print(f"🔍 Generated Optimized CTE Query2 SQL:")
-    print(f"🔍 {sql_query[:500]}...")
+    logger.debug("🔍 Generated Optimized CTE Query2 SQL:\n%.500s...", sql_query)
     
     try:
         # Try the full range first
@@ -559,50 +698,63 @@ def fetch_query2_in_smaller_chunks(date_from, date_to, publisher_id):
     
     print(f"📊 Breaking into {len(chunks)} 7-day chunks for timeout recovery")
     
+    def fetch_chunk(chunk):
+        chunk_start, chunk_end = chunk
+        try:
+            return fetch_query2_with_timeout_fallback(chunk_start, chunk_end, publisher_id)
+        except Exception as e:
+            print(f"❌ Failed chunk {chunk_start} to {chunk_end}: {e}")
+            return [], []
+    
+    # Chunks are independent, so run them concurrently (bounded to spare Superset)
+    # and merge the results back in chunk order
     all_data = []
     columns = None
     
-    for chunk_start, chunk_end in chunks:
-        try:
-            chunk_columns, chunk_data = fetch_query2_with_timeout_fallback(
-                chunk_start, chunk_end, publisher_id
-            )
+    with ThreadPoolExecutor(max_workers=min(SUPERSET_MAX_CONCURRENCY, len(chunks) or 1)) as executor:
+        for (chunk_start, chunk_end), (chunk_columns, chunk_data) in zip(chunks, executor.map(fetch_chunk, chunks)):
             if chunk_data:
                 if columns is None:
                     columns = chunk_columns
                 all_data.extend(chunk_data)
                 print(f"✅ Chunk {chunk_start} to {chunk_end}: {len(chunk_data)} rows")
-        except Exception as e:
-            print(f"❌ Failed chunk {chunk_start} to {chunk_end}: {e}")
-            continue
     
     return columns or [], all_data
 
-def filter_cache_data_by_date_range(columns, data, date_from, date_to):
-    """Filter cached data by date range"""
+def filter_cache_data_by_date_range(columns, data, date_from, date_to, col_index=None, sorted_by_date=False):
+    """Filter cached data by date range
+    
+    When the cached rows are known to be sorted by date_key (see cache_set_unified),
+    the window is located with two binary searches instead of a full scan.
+    """
     try:
-        date_key_index = columns.index('date_key')
-        filtered_data = []
+        date_key_index = get_column_index(columns, 'date_key', col_index)
         
-        # Debug: Print the first few dates to see the format
-        print(f"🔍 DEBUG: Filtering {len(data)} rows from {date_from} to {date_to}")
-        print(f"🔍 DEBUG: First 5 dates in cache:")
-        for i, row in enumerate(data[:5]):
-            row_date = str(row[date_key_index])
-            print(f"  Row {i}: '{row_date}' (type: {type(row[date_key_index])})")
+        if sorted_by_date:
+            row_date = lambda row: row_date_key(row, date_key_index)
+            start = bisect_left(data, date_from, key=row_date)
+            end = bisect_right(data, date_to, key=row_date, lo=start)
+            return data[start:end]
+        
+        filtered_data = []
         
-        # Debug: Show the actual date range in the cache
-        all_dates = [str(row[date_key_index]) for row in data]
-        unique_dates = sorted(set(all_dates))
-        print(f"🔍 DEBUG: Available dates in cache: {unique_dates[:10]}... (total: {len(unique_dates)} unique dates)")
-        print(f"🔍 DEBUG: Date range in cache: {min(unique_dates)} to {max(unique_dates)}")
+        # Debug diagnostics scan the whole cache, so only build them when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔍 Filtering %d rows from %s to %s", len(data), date_from, date_to)
+            for i, row in enumerate(data[:5]):
+                logger.debug("  Row %d: '%s' (type: %s)", i, row[date_key_index], type(row[date_key_index]))
+            
+            unique_dates = sorted({str(row[date_key_index]) for row in data})
+            if unique_dates:
+                logger.debug("🔍 Available dates in cache: %s... (total: %d unique dates)", unique_dates[:10], len(unique_dates))
+                logger.debug("🔍 Date range in cache: %s to %s", unique_dates[0], unique_dates[-1])
         
         for row in data:
             row_date = str(row[date_key_index])
             if date_from <= row_date <= date_to:
                 filtered_data.append(row)
         
-        print(f"🔍 DEBUG: Filtered {len(filtered_data)} rows that match date range")
+        logger.debug("🔍 Filtered %d rows that match date range", len(filtered_data))
         return filtered_data
     except (ValueError, IndexError) as e:
         print(f"❌ Error filtering cache data by date range: {e}")
@@ -640,39 +792,11 @@ def fetch_all_seat_ids_bulk(date_from, date_to):
     print(f"📊 Found {len(existing_seat_ids)} existing seat_ids to collect")
     
     # Build SQL for only existing seat_ids
-    seat_id_list = "', '".join(existing_seat_ids)
-    sql = f"""
-    SELECT 
-        t.name AS tag_name,
-        m.seat_id,
-        m.tag_id,
-        SUM(m.ad_query_requests) AS total_ad_query_requests,
-        SUM(m.ad_query_responses) AS total_ad_query_responses,
-        SUM(m.ad_slot_requests) AS total_ad_slot_requests,
-        SUM(m.ad_slot_responses) AS total_ad_slot_responses,
-        SUM(m.ad_creative_fetches) AS total_ad_creative_fetches,
-        SUM(m.ad_creative_responses) AS total_ad_creative_responses,
-        CASE 
-            WHEN SUM(m.ad_slot_requests) > 0 
-            THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_slot_requests))
-            ELSE 0 
-        END AS fill_rate,
-        CASE 
-            WHEN SUM(m.ad_creative_responses) > 0 
-            THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_creative_responses))
-            ELSE 0 
-        END AS avg_render_rate,
-        SUM(m.num_impressions) AS total_impressions,
-        m.date_key
-    FROM advertising.agg_raps_rams_metrics_daily_v2 m
-    LEFT JOIN ads.dim_rams_tags_history t ON m.tag_id = t.tag_id AND t.date_key = m.date_key
-    WHERE m.date_key BETWEEN '{date_from}' AND '{date_to}' 
-      AND m.seat_id IN ('{seat_id_list}')
-      AND m.date_id_est IS NOT NULL
-    GROUP BY 
-        t.name, m.seat_id, m.tag_id, m.date_key
-    ORDER BY m.seat_id, m.date_key DESC
-    """
+    sql = _Q1_BULK_TEMPLATE.substitute(
+        date_from=sql_literal(date_from),
+        date_to=sql_literal(date_to),
+        seat_id_list=', '.join(sql_literal(seat_id) for seat_id in existing_seat_ids)
+    )
     
     print(f"🔍 Executing bulk Query 1 SQL for {len(existing_seat_ids)} seat_ids...")
     
@@ -685,36 +809,43 @@ def fetch_all_seat_ids_bulk(date_from, date_to):
         
         print(f"✅ Bulk query returned {len(all_data)} rows for {len(existing_seat_ids)} seat_ids")
         
-        # Group data by seat_id
-        seat_id_groups = {}
-        for row in all_data:
-            try:
-                seat_id_index = columns.index('seat_id')
-                seat_id = row[seat_id_index]
-                
-                if seat_id not in seat_id_groups:
-                    seat_id_groups[seat_id] = []
-                seat_id_groups[seat_id].append(row)
-            except (IndexError, ValueError) as e:
-                print(f"⚠️ Error processing row: {e}")
-                continue
+        # Group data by seat_id (stable sort keeps each seat's rows in query order;
+        # the SQL already orders by seat_id so this is a near-linear pass)
+        try:
+            seat_id_index = columns.index('seat_id')
+        except ValueError:
+            print(f"❌ Bulk query result has no seat_id column: {columns}")
+            return False
+        
+        seat_id_key = itemgetter(seat_id_index)
+        valid_rows = [row for row in all_data if len(row) > seat_id_index]
+        if len(valid_rows) != len(all_data):
+            print(f"⚠️ Skipped {len(all_data) - len(valid_rows)} rows without a seat_id value")
+        valid_rows.sort(key=seat_id_key)
+        seat_id_groups = {
+            seat_id: list(rows)
+            for seat_id, rows in groupby(valid_rows, key=seat_id_key)
+        }
         
         print(f"📊 Grouped data into {len(seat_id_groups)} seat_id groups")
         
-        # Cache each seat_id group separately
+        # Cache each seat_id group separately, all inside one write transaction so
+        # the whole flush pays for a single journal sync instead of one per seat
         success_count = 0
-        for seat_id, seat_data in seat_id_groups.items():
-            try:
-                if seat_data:
-                    cache_success = cache_set_unified('query1', seat_id, columns, seat_data)
-                    if cache_success:
-                        success_count += 1
-                        print(f"✅ Cached {len(seat_data)} rows for seat_id {seat_id}")
-                    else:
-                        print(f"❌ Failed to cache data for seat_id {seat_id}")
-            except Exception as e:
-                print(f"❌ Error caching seat_id {seat_id}: {e}")
-                continue
+        with cache_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for seat_id, seat_data in seat_id_groups.items():
+                try:
+                    if seat_data:
+                        cache_success = cache_set_unified('query1', seat_id, columns, seat_data, conn=conn)
+                        if cache_success:
+                            success_count += 1
+                            logger.debug("✅ Cached %d rows for seat_id %s", len(seat_data), seat_id)
+                        else:
+                            print(f"❌ Failed to cache data for seat_id {seat_id}")
+                except Exception as e:
+                    print(f"❌ Error caching seat_id {seat_id}: {e}")
+                    continue
         
         print(f"🎉 Bulk collection completed: {success_count}/{len(seat_id_groups)} seat_ids cached successfully")
         return True
@@ -724,7 +855,8 @@ def fetch_all_seat_ids_bulk(date_from, date_to):
         return False
 
 
-sql_test = """
+# Filled with string.Template (one pass, values escaped via sql_literal)
+sql_test = string.Template("""
     SELECT 
         t.name AS tag_name,
         m.seat_id,
@@ -749,77 +881,69 @@ sql_test = """
         m.date_key
     FROM advertising.agg_raps_rams_metrics_daily_v2 m
     LEFT JOIN ads.dim_rams_tags_history t ON m.tag_id = t.tag_id AND t.date_key = m.date_key
-    WHERE m.date_key = 'YESTERDAY_DATE' 
-      AND m.seat_id IN ('SEAT_ID_LIST')
+    WHERE m.date_key = $date_key 
+      AND m.seat_id IN ($seat_id_list)
       AND m.date_id_est IS NOT NULL
     GROUP BY 
         t.name, m.seat_id, m.tag_id, m.date_key
     ORDER BY m.seat_id, m.date_key DESC
-    """
+    """)
 
 
 
 
-def fetch_from_superset_api_test(sql_test):
+def fetch_from_superset_api_test(sql_test=sql_test):
     
-    with sqlite3.connect(DB_PATH) as conn:
-                    c = conn.cursor()
-                    c.execute("SELECT cache_key FROM query_cache WHERE cache_key LIKE 'seat_id_%'")
-                    publisher_cache_keys = [row[0] for row in c.fetchall()]
-                    seat_ids = [key.replace('seat_id_', '') for key in publisher_cache_keys]
-                    print(f"Seat IDs: {seat_ids}")
-    
-    # Create seat_id list for SQL
-    seat_id_list = "', '".join(seat_ids)
+    seat_ids = get_cached_seat_ids()
+    print(f"Seat IDs: {len(seat_ids)}")
+    logger.debug("Seat IDs: %s", seat_ids)
+    if not seat_ids:
+        print("⚠️ No cached seat IDs to query")
+        return
     
     # Generate dynamic SQL
     yesterday_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    sql_test = sql_test.replace('YESTERDAY_DATE', yesterday_date)
-    sql_test = sql_test.replace('SEAT_ID_LIST', seat_id_list)
+    sql = sql_test.substitute(
+        date_key=sql_literal(yesterday_date),
+        seat_id_list=', '.join(sql_literal(seat_id) for seat_id in seat_ids)
+    )
     
     print(f"🔍 Executing bulk Query1_test")
     payload = {
         "database_id": SUPERSET_DB_ID,
-        "sql": sql_test,
+        "sql": sql,
         "schema": "advertising"
     }
     
     try:
         print(f"🔄 Executing Superset API call...")
-        response = requests.post(
+        response = SUPERSET_SESSION.post(
             SUPERSET_EXECUTE_URL, 
             headers=SUPERSET_HEADERS,
-            data=json.dumps(payload)
+            data=json.dumps(payload),
+            timeout=600
         ) 
         print(f"Status: {response.status_code}")
-        print(f"Response length: {len(response.text)} characters")
-        print(f"Response preview: {response.text[:500]}...")
-        
-        # Always try to parse the response regardless of status
-        try:
-            data = response.text
-            print(f"Data type: {type(data)}")
-            if isinstance(data, list):
-                print(f"Number of rows: {len(data)}")
-        except Exception as e:
-            print(f"❌ Error parsing JSON: {e}")
+        # Size only: previewing response.text would decode the whole body into a str
+        print(f"Response length: {len(response.content)} bytes")
         
         # Parse and print seat_id and impressions
         if response.status_code == 200:
             try:
-                data = response.json()
+                data = json.loads(response.content)
                 
                 # Handle different response formats
                 if isinstance(data, dict) and 'data' in data:
                     # Nested dictionary with 'data' key
                     rows = data['data']
                     if isinstance(rows, list):
-                        print(f"\n📊 All Data (Seat ID, Tag Name, Impressions):")
-                        for i, row in enumerate(rows):
-                            seat_id = row.get('seat_id', 'N/A')
-                            tag_name = row.get('tag_name', 'N/A')
-                            impressions = row.get('total_impressions', 'N/A')
-                            print(f"  {i+1}. Seat ID: {seat_id}, Tag: {tag_name}, Impressions: {impressions}")
+                        print(f"\n📊 Received {len(rows)} rows")
+                        # Dumping every row is only worth its formatting cost when debugging
+                        if logger.isEnabledFor(logging.DEBUG):
+                            for i, row in enumerate(rows):
+                                logger.debug("  %d. Seat ID: %s, Tag: %s, Impressions: %s", i + 1,
+                                             row.get('seat_id', 'N/A'), row.get('tag_name', 'N/A'),
+                                             row.get('total_impressions', 'N/A'))
                     else:
                         print(f"❌ 'data' is not a list: {type(rows)}")
                 elif isinstance(data, list):
@@ -844,47 +968,36 @@ def fetch_from_superset_api_test(sql_test):
 
 
 
-def check_cache_for_yesterday():
+def check_cache_for_yesterday(yesterday=None):
     """Check what seat_ids already have yesterday's data cached"""
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    
-    with sqlite3.connect(DB_PATH) as conn:
+    yesterday = yesterday or (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    # max_date_key is maintained by cache_set_unified; the cache never holds today's
+    # data, so "latest cached date < yesterday" means exactly "yesterday is missing"
+    with cache_connection() as conn:
+        # Entries written without max_date_key (e.g. admin imports) are decoded once
+        # here instead of being reported missing and refetched every run
+        backfill_max_date_keys(conn)
         c = conn.cursor()
-        # Get all cached seat_ids
-        c.execute("SELECT cache_key FROM query_cache WHERE cache_key LIKE 'seat_id_%'")
-        cached_keys = [row[0] for row in c.fetchall()]
-        
-        # Check which ones have yesterday's data
-        missing_seat_ids = []
-        for cache_key in cached_keys:
-            seat_id = cache_key.replace('seat_id_', '')
-            cache_object = cache_get_unified('query1', seat_id)
-            
-            if cache_object and 'data' in cache_object:
-                # Check if yesterday's data exists in cache
-                # Find date_key column index
-                columns = cache_object.get('columns', [])
-                date_key_index = columns.index('date_key') if 'date_key' in columns else None
-                
-                if date_key_index is not None:
-                    has_yesterday = any(
-                        str(row[date_key_index]) == yesterday 
-                        for row in cache_object['data']
-                        if isinstance(row, list) and len(row) > date_key_index
-                    )
-                else:
-                    has_yesterday = False
-                if not has_yesterday:
-                    missing_seat_ids.append(seat_id)
-            else:
-                missing_seat_ids.append(seat_id)
-        
-        return missing_seat_ids
+        c.execute("""
+            SELECT seat_id FROM query_cache
+            WHERE seat_id IS NOT NULL
+              AND (max_date_key IS NULL OR max_date_key < ?)
+        """, (yesterday,))
+        return [seat_id for (seat_id,) in c.fetchall()]
 
 
-def fetch_missing_yesterday_data():
-    """Only fetch data for seat_ids missing yesterday's data"""
-    missing_seat_ids = check_cache_for_yesterday()
+def fetch_missing_yesterday_data(missing_seat_ids=None, yesterday=None):
+    """Only fetch data for seat_ids missing yesterday's data
+    
+    Pass missing_seat_ids if check_cache_for_yesterday() has already been run, and
+    yesterday to keep the whole run on one date.
+    """
+    # Get yesterday's date
+    yesterday = yesterday or (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    if missing_seat_ids is None:
+        missing_seat_ids = check_cache_for_yesterday(yesterday)
     
     if not missing_seat_ids:
         print("✅ All seat_ids already have yesterday's data cached")
@@ -892,45 +1005,48 @@ def fetch_missing_yesterday_data():
     
     print(f"�� Fetching yesterday's data for {len(missing_seat_ids)} missing seat_ids")
     
-    # Get yesterday's date
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    # A failed chunk only loses its own seats; they are retried on the next run
+    result = []
+    failed_seat_ids = []
+    for chunk, chunk_rows in fetch_yesterday_chunks(missing_seat_ids, yesterday):
+        if chunk_rows is None:
+            failed_seat_ids.extend(chunk)
+            continue
+        result.extend(chunk_rows)
     
-    # Create seat_id list for SQL
-    seat_id_list = "', '".join(missing_seat_ids)
+    if failed_seat_ids:
+        print(f"⚠️ Fetch failed for {len(failed_seat_ids)} of {len(missing_seat_ids)} seat_ids")
+        if not result:
+            return None
     
-    # Build the SQL query for yesterday's data
-    sql = f"""
-    SELECT 
-        t.name AS tag_name,
-        m.seat_id,
-        m.tag_id,
-        SUM(m.ad_query_requests) AS total_ad_query_requests,
-        SUM(m.ad_query_responses) AS total_ad_query_responses,
-        SUM(m.ad_slot_requests) AS total_ad_slot_requests,
-        SUM(m.ad_slot_responses) AS total_ad_slot_responses,
-        SUM(m.ad_creative_fetches) AS total_ad_creative_fetches,
-        SUM(m.ad_creative_responses) AS total_ad_creative_responses,
-        CASE 
-            WHEN SUM(m.ad_slot_requests) > 0 
-            THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_slot_requests))
-            ELSE 0 
-        END AS fill_rate,
-        CASE 
-            WHEN SUM(m.ad_creative_responses) > 0 
-            THEN (SUM(m.num_impressions) * 100.0 / SUM(m.ad_creative_responses))
-            ELSE 0 
-        END AS avg_render_rate,
-        SUM(m.num_impressions) AS total_impressions,
-        m.date_key
-    FROM advertising.agg_raps_rams_metrics_daily_v2 m
-    LEFT JOIN ads.dim_rams_tags_history t ON m.tag_id = t.tag_id AND t.date_key = m.date_key
-    WHERE m.date_key = '{yesterday}' 
-      AND m.seat_id IN ('{seat_id_list}')
-      AND m.date_id_est IS NOT NULL
-    GROUP BY 
-        t.name, m.seat_id, m.tag_id, m.date_key
-    ORDER BY m.seat_id, m.date_key DESC
+    print(f"✅ Successfully fetched {len(result)} rows for yesterday")
+    return result
+
+
+def fetch_yesterday_chunks(seat_ids, yesterday, chunk_size=SEAT_IDS_PER_QUERY,
+                            max_workers=SUPERSET_MAX_CONCURRENCY):
+    """Fetch yesterday's rows in chunk_size seat chunks, max_workers requests at a time
+    
+    Yields (chunk, rows) as each request completes, so callers can process one
+    chunk while the rest are still in flight. rows is None if that request failed.
     """
+    # Smaller VALUES lists also keep each query cheap for the Superset/Presto parser
+    chunks = [seat_ids[start:start + chunk_size] for start in range(0, len(seat_ids), chunk_size)]
+    if not chunks:
+        return
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        futures = {executor.submit(_fetch_yesterday_rows, chunk, yesterday): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _fetch_yesterday_rows(seat_ids, yesterday):
+    """Fetch yesterday's Query 1 rows for a batch of seat_ids as tuples (None on failure)"""
+    sql = _Q1_SEATS_DAY_TEMPLATE.substitute(
+        seat_values=', '.join(f"({sql_literal(seat_id)})" for seat_id in seat_ids),
+        date_key=sql_literal(yesterday)
+    )
     
     payload = {
         "database_id": SUPERSET_DB_ID,
@@ -939,8 +1055,8 @@ def fetch_missing_yesterday_data():
     }
     
     try:
-        print(f"🔄 Executing Superset API call for yesterday's data...")
-        response = requests.post(
+        print(f"🔄 Executing Superset API call for yesterday's data ({len(seat_ids)} seat_ids)...")
+        response = SUPERSET_SESSION.post(
             SUPERSET_EXECUTE_URL, 
             headers=SUPERSET_HEADERS,
             data=json.dumps(payload),
@@ -948,11 +1064,11 @@ def fetch_missing_yesterday_data():
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = json.loads(response.content)
             if isinstance(data, dict) and 'data' in data:
-                result = data['data']
-                print(f"✅ Successfully fetched {len(result)} rows for yesterday")
-                return result
+                # Keep only the cached columns as tuples, so each chunk's parsed dicts
+                # are freed on return instead of being held until the fetch is stored
+                return [_query1_row(row) for row in data['data']]
             else:
                 print(f"❌ Unexpected API response format")
                 return None
@@ -966,96 +1082,90 @@ def fetch_missing_yesterday_data():
 
 
 
-def store_yesterday_data_to_cache(api_data):
-    """Store the bulk API response back to individual seat_id caches"""
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+def store_yesterday_data_to_cache(api_data, yesterday=None):
+    """Store the bulk API response back to individual seat_id caches
+    
+    Rows may be Superset dicts or tuples already in _QUERY1_COLUMNS order.
+    """
+    yesterday = yesterday or (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
     
     if not api_data or len(api_data) == 0:
         print("❌ No data to cache")
         return
     
-    # Define the expected columns based on the SQL query
-    columns = ['tag_name', 'seat_id', 'tag_id', 'total_ad_query_requests', 'total_ad_query_responses', 
-               'total_ad_slot_requests', 'total_ad_slot_responses', 'total_ad_creative_fetches', 
-               'total_ad_creative_responses', 'fill_rate', 'avg_render_rate', 'total_impressions', 'date_key']
+    columns = _QUERY1_COLUMNS
     
-    # Group data by seat_id (data is in dictionary format)
-    seat_id_groups = {}
+    # Group data by seat_id. Dict rows are converted to column-ordered tuples with a
+    # single itemgetter call each, then one stable sort plus groupby replaces the
+    # per-row dict bookkeeping.
     print(f"🔍 Processing {len(api_data)} rows for grouping")
-    print(f"🔍 First row: {api_data[0] if api_data else 'No data'}")
-    
-    for i, row in enumerate(api_data):
-        if isinstance(row, dict) and 'seat_id' in row:
-            seat_id = row['seat_id']
-            if seat_id:
-                if seat_id not in seat_id_groups:
-                    seat_id_groups[seat_id] = []
-                seat_id_groups[seat_id].append(row)
-            else:
-                print(f"⚠️ Row {i}: Empty seat_id")
-        else:
-            print(f"⚠️ Row {i}: Invalid format - {type(row)}")
+    logger.debug("🔍 First row: %s", api_data[0])
     
-    print(f"🔍 Grouped into {len(seat_id_groups)} seat IDs: {list(seat_id_groups.keys())}")
+    rows = [_query1_row(row) if isinstance(row, dict) else row for row in api_data]
+    valid_rows = [row for row in rows
+                  if isinstance(row, (list, tuple)) and len(row) > _SEAT_ID_INDEX and row[_SEAT_ID_INDEX]]
+    if len(valid_rows) != len(api_data):
+        print(f"⚠️ Skipped {len(api_data) - len(valid_rows)} rows with an invalid format or empty seat_id")
     
-    # Store each seat_id's data to its own cache
+    seat_id_key = itemgetter(_SEAT_ID_INDEX)
+    valid_rows.sort(key=seat_id_key)
+    seat_id_groups = {seat_id: list(rows) for seat_id, rows in groupby(valid_rows, key=seat_id_key)}
+    
+    print(f"🔍 Grouped into {len(seat_id_groups)} seat IDs")
+    logger.debug("Seat IDs: %s", list(seat_id_groups))
+    
+    # Store each seat_id's data to its own cache, all inside one write transaction
+    # so the whole batch pays for a single journal sync instead of one per seat
     print(f"🔄 Processing {len(seat_id_groups)} seat IDs for caching")
-    for seat_id, seat_data in seat_id_groups.items():
-        if seat_data:
-            print(f"🔄 Processing seat_id: {seat_id} with {len(seat_data)} rows")
-            # Get existing cache or create new
-            existing_cache = cache_get_unified('query1', seat_id) or {'data': [], 'columns': columns}
-            print(f"📊 Existing cache has {len(existing_cache['data'])} rows")
-            
-            # Add yesterday's data (avoid duplicates)
-            # Find date_key column index in existing cache
-            existing_columns = existing_cache.get('columns', [])
-            date_key_index = existing_columns.index('date_key') if 'date_key' in existing_columns else None
-            
-            if date_key_index is not None:
-                existing_dates = {str(row[date_key_index]) for row in existing_cache['data'] 
-                                if isinstance(row, list) and len(row) > date_key_index}
-            else:
-                existing_dates = set()
-            
-            print(f"📅 Existing dates: {sorted(existing_dates)}")
-            print(f"🎯 Yesterday: {yesterday}")
+    with cache_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        # Common case: yesterday is newer than everything cached, so append in SQL
+        # (prepared once per batch shape, run with executemany) without decoding and
+        # re-encoding any seat's whole history
+        appended_seat_ids = cache_append_rows_bulk('query1', seat_id_groups, columns, conn=conn)
+        cached_count = len(appended_seat_ids)
+        
+        # The rest either have no cache entry yet, already reach yesterday, or need a
+        # merge. "Already has yesterday" is answered from max_date_key in SQL (the cache
+        # never holds today's data) instead of decoding each seat to build a date set.
+        remaining = {seat_id: seat_data for seat_id, seat_data in seat_id_groups.items()
+                     if seat_id not in appended_seat_ids}
+        max_date_keys = get_max_date_keys('query1', remaining, conn=conn)
+        
+        for seat_id, seat_data in remaining.items():
+            max_date_key = max_date_keys.get(seat_id)
+            if max_date_key is not None and max_date_key >= yesterday:
+                logger.debug("⚠️ Yesterday's data already exists for seat_id %s", seat_id)
+                continue
             
-            if yesterday not in existing_dates:
-                # Convert dict data to list format for consistency with existing cache
-                list_data = []
-                for row in seat_data:
-                    list_row = [row.get(col, '') for col in columns]
-                    list_data.append(list_row)
-                
-                existing_cache['data'].extend(list_data)
-                cache_set_unified('query1', seat_id, columns, existing_cache['data'])
-                print(f"✅ Cached {len(seat_data)} rows for seat_id {seat_id}")
-                print(f"📊 Total rows in cache now: {len(existing_cache['data'])}")
-            else:
-                print(f"⚠️ Yesterday's data already exists for seat_id {seat_id}")
-        else:
-            print(f"⚠️ No data for seat_id: {seat_id}")
-
+            # cache_set_unified merges with the existing entry and skips duplicate rows
+            if cache_set_unified('query1', seat_id, columns, seat_data, conn=conn):
+                cached_count += 1
+                logger.debug("✅ Cached %d rows for seat_id %s", len(seat_data), seat_id)
+    
+    print(f"✅ Cached yesterday's data for {cached_count} of {len(seat_id_groups)} seat_ids")
 
 def fetch_and_cache_yesterday_data():
     """Main function to fetch and cache yesterday's data"""
+    # Resolve yesterday once so every step agrees even if the run spans midnight
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    
     # 1. Check what's missing
-    missing_seat_ids = check_cache_for_yesterday()
+    missing_seat_ids = check_cache_for_yesterday(yesterday)
     print(f"🔍 Missing seat IDs: {missing_seat_ids}")
     
-    # 2. Fetch missing data
+    # 2. Fetch missing data in concurrent chunks
     if missing_seat_ids:
-        api_data = fetch_missing_yesterday_data()
-        print(f"📊 Fetched data: {len(api_data) if api_data else 0} rows")
-        
-        # 3. Store to cache
-        if api_data:
-            print(f"💾 Storing data to cache...")
-            store_yesterday_data_to_cache(api_data)
-            print(f"✅ Data storage completed")
-        else:
-            print(f"❌ No data to store")
+        for chunk, api_data in fetch_yesterday_chunks(missing_seat_ids, yesterday):
+            print(f"📊 Fetched data: {len(api_data) if api_data else 0} rows for {len(chunk)} seat IDs")
+            
+            # 3. Store each chunk to cache while later chunks are still in flight
+            if api_data:
+                print(f"💾 Storing data to cache...")
+                store_yesterday_data_to_cache(api_data, yesterday)
+                print(f"✅ Data storage completed")
+            else:
+                print(f"❌ No data to store")
     else:
         print(f"✅ No missing seat IDs")
     
@@ -1081,14 +1191,15 @@ def check_available_dates():
     
     try:
         print(f"🔍 Checking available dates in table...")
-        response = requests.post(
+        response = SUPERSET_SESSION.post(
             SUPERSET_EXECUTE_URL, 
             headers=SUPERSET_HEADERS,
-            data=json.dumps(payload)
+            data=json.dumps(payload),
+            timeout=600
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = json.loads(response.content)
             if isinstance(data, dict) and 'data' in data:
                 result = data['data']
                 if result and len(result) > 0:
@@ -1135,14 +1246,15 @@ def check_recent_dates():
     
     try:
         print(f"🔍 Checking recent dates (last 20 days)...")
-        response = requests.post(
+        response = SUPERSET_SESSION.post(
             SUPERSET_EXECUTE_URL, 
             headers=SUPERSET_HEADERS,
-            data=json.dumps(payload)
+            data=json.dumps(payload),
+            timeout=600
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = json.loads(response.content)
             if isinstance(data, dict) and 'data' in data:
                 result = data['data']
                 print(f"📅 Recent dates with data:")